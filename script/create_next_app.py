@@ -7,11 +7,22 @@ import openai
 from pathlib import Path
 import re
 from review_app import review_landing_page
-from image_gen import get_image
+from image_gen import cancel_upgrades, copy_image, get_image, models, pending_upgrade_paths, queue_upgrade, wait_for_upgrades, write_file
+from image_index import build_index
 from pm import ProjectManager
+from tool_loop import ToolLoop, empty_usage
 import json
 
 reasoning_effort = "medium"
+# Reuse an existing image instead of rendering when descriptions are this similar (0-1)
+image_reuse_threshold = 0.9
+# Also look for reusable images in the other projects under projects/
+image_reuse_all_projects = False
+# Render a fast draft image and upgrade it to the high-quality model in the background
+progressive_images = True
+# Bounds on the generate_image tool loop in modify_app; past either, the model must answer
+max_tool_rounds = 8
+max_tool_loop_tokens = 400_000
 
 # This script is used to create a new Next.js app in the projects directory.
 
@@ -24,6 +35,7 @@ class NextApp:
         self.dev_process = None
         self.openai_client = openai.OpenAI()  # Assumes OPENAI_API_KEY env var is set
         self.images_json_path = os.path.join(self.app_dir, 'public', 'images.json')
+        self.session_usage = empty_usage()
 
     def create_project_directory(self):
         os.makedirs(self.project_dir, exist_ok=True)
@@ -143,19 +155,83 @@ class NextApp:
                 return {}
         return {}
 
+    def write_image_descriptions(self, images):
+        """Write all image descriptions to JSON file."""
+        # N.B. written atomically, image upgrade workers read this file concurrently
+        write_file(self.images_json_path, json.dumps(images, indent=2).encode('utf-8'))
+
     def save_image_description(self, filename: str, description: str):
         """Save image description to JSON file."""
-        os.makedirs(os.path.dirname(self.images_json_path), exist_ok=True)
         images = self.load_image_descriptions()
         images[filename] = description
-        with open(self.images_json_path, 'w') as f:
-            json.dump(images, f, indent=2)
+        self.write_image_descriptions(images)
+
+    def prune_image_descriptions(self):
+        """Drop descriptions of images that the app files no longer reference."""
+        app_text = []
+        for root, _, files in os.walk(os.path.join(self.app_dir, 'app')):
+            for file in files:
+                file_path = os.path.join(root, file)
+                if self.should_include_file(file_path):
+                    content = self.read_file_content(file_path)
+                    if content is not None:
+                        app_text.append(content)
+        app_text = "\n".join(app_text)
+
+        images = self.load_image_descriptions()
+        referenced = {filename: description for filename, description in images.items() if f"/{filename}" in app_text}
+        if len(referenced) != len(images):
+            print(f"Dropping unreferenced images: {', '.join(sorted(set(images) - set(referenced)))}")
+            self.write_image_descriptions(referenced)
+
+    def reuse_image(self, filename: str, description: str, image_index):
+        """Keep or copy an existing image matching the description. Returns the tool response, or None."""
+        full_filename = os.path.join(self.app_dir, 'public', filename)
+        if os.path.exists(full_filename) and image_index.description(full_filename) == description:
+            print(f"Keeping {full_filename}, description is unchanged")
+            return f"Image {filename} already matches this description and was kept as is."
+
+        # Never reuse the file being redrawn, or drafts that are still waiting for their upgrade
+        exclude = {full_filename} | pending_upgrade_paths()
+        match = image_index.find_similar(description, image_reuse_threshold, exclude)
+        if match is None:
+            return None
+        existing_path, existing_description, score = match
+        print(f"Reusing {existing_path} (similarity {score:.2f})")
+        copy_image(existing_path, full_filename)
+        # Record what the copied file actually shows
+        self.save_image_description(filename, existing_description)
+        image_index.add(full_filename, existing_description)
+        return (f"Image {filename} was reused from an existing image ({os.path.basename(existing_path)}) with a nearly identical description and saved to the public directory. It shows: {existing_description}\n"
+                f"If a new rendering is needed, call generate_image again with allow_reuse set to false.")
+
+    def generate_or_reuse_image(self, filename: str, description: str, image_index, allow_reuse: bool = True) -> str:
+        """Render an image, or copy a near-identical existing one. Returns the tool response."""
+        if allow_reuse:
+            response = self.reuse_image(filename, description, image_index)
+            if response is not None:
+                return response
+
+        full_filename = os.path.join(self.app_dir, 'public', filename)
+        if progressive_images:
+            get_image(description, full_filename, model=models['flux-s'])
+            self.save_image_description(filename, description)
+            # Only swap in the upgrade if the image wasn't since re-described, or dropped
+            # from the page (see prune_image_descriptions)
+            is_current = lambda: self.load_image_descriptions().get(filename) == description
+            queue_upgrade(description, full_filename, is_current=is_current)
+        else:
+            get_image(description, full_filename)
+            self.save_image_description(filename, description)
+        image_index.add(full_filename, description)
+        return f"Image {filename} has been generated and saved to the public directory."
 
     def modify_app(self, user_instruction):
-        """Modify the app based on user instruction using OpenAI."""
+        """Modify the app based on user instruction using OpenAI. Returns the token usage."""
+        usage = empty_usage()
         if not self.project_exists():
             print("Project doesn't exist. Create it first.")
-            return
+            return usage
 
         # Load existing image descriptions
         existing_images = self.load_image_descriptions()
@@ -200,87 +276,80 @@ Important notes:
 """
 
         try:
+            image_index = build_index(self.app_dir, self.project_dir if image_reuse_all_projects else None)
+
             messages = [
                 {"role": "system", "content": "You are a helpful assistant that modifies Next.js applications."},
                 {"role": "user", "content": prompt}
             ]
 
-            while True:
-                response = self.openai_client.chat.completions.create(
-                    model="o3-mini",
-                    messages=messages,
-                    tools=[{
-                        "type": "function",
-                        "function": {
-                            "name": "generate_image",
-                            "description": "Generate an image with the specified filename and description",
-                            "parameters": {
-                                "type": "object",
-                                "properties": {
-                                    "filename": {
-                                        "type": "string",
-                                        "description": "The filename to save the image as (e.g. hero.png)"
-                                    },
-                                    "description": {
-                                        "type": "string",
-                                        "description": "Detailed description of the image to generate"
-                                    }
+            def handle_generate_image(args):
+                print(f"\nImage Generation Request:")
+                print(f"Filename: {args['filename']}")
+                print(f"Description: {args['description']}")
+                return self.generate_or_reuse_image(args['filename'], args['description'], image_index,
+                                                    allow_reuse=args.get('allow_reuse', True))
+
+            loop = ToolLoop(
+                self.openai_client,
+                model="o3-mini",
+                tools=[{
+                    "type": "function",
+                    "function": {
+                        "name": "generate_image",
+                        "description": "Generate an image with the specified filename and description",
+                        "parameters": {
+                            "type": "object",
+                            "properties": {
+                                "filename": {
+                                    "type": "string",
+                                    "description": "The filename to save the image as (e.g. hero.png)"
+                                },
+                                "description": {
+                                    "type": "string",
+                                    "description": "Detailed description of the image to generate"
                                 },
-                                "required": ["filename", "description"]
-                            }
+                                "allow_reuse": {
+                                    "type": "boolean",
+                                    "description": "Whether an existing image with the same description may be reused instead of rendering a new one (default true)"
+                                }
+                            },
+                            "required": ["filename", "description"]
                         }
-                    }],
-                    tool_choice="auto",
-                    reasoning_effort=reasoning_effort,
-                )
-                
-                response_message = response.choices[0].message
-                messages.append({"role": "assistant", "content": response_message.content, "tool_calls": response_message.tool_calls})
-
-                # print(response_message.content)
-                # print(response_message.tool_calls)
-
-                # If there are no tool calls, we're done
-                if not response_message.tool_calls:
-                    break
-
-                # Handle tool calls
-                tool_call_responses = []
-                for tool_call in response_message.tool_calls:
-                    if tool_call.function.name == "generate_image":
-                        args = json.loads(tool_call.function.arguments)
-                        print(f"\nImage Generation Request:")
-                        print(f"Filename: {args['filename']}")
-                        print(f"Description: {args['description']}")
-                        
-                        # Save the image description
-                        self.save_image_description(args['filename'], args['description'])
-                        
-                        # Here you would actually call your image generation code
-                        full_filename = os.path.join(self.app_dir, 'public', args['filename'])
-                        get_image(args['description'], full_filename)
-
-                        tool_call_responses.append({
-                            "tool_call_id": tool_call.id,
-                            "role": "tool",
-                            "name": tool_call.function.name,
-                            "content": f"Image {args['filename']} has been generated and saved to the public directory."
-                        })
-
-                # Add tool responses to messages
-                messages.extend(tool_call_responses)
+                    }
+                }],
+                handlers={"generate_image": handle_generate_image},
+                max_rounds=max_tool_rounds,
+                max_total_tokens=max_tool_loop_tokens,
+                reasoning_effort=reasoning_effort,
+            )
+            result = loop.run(messages, usage)
+            print(f"Tool loop finished after {result.rounds} round(s) ({result.stop_reason}), usage: {usage}")
 
             # Extract and write the files from the final response
-            if response_message.content:
-                files_to_write = self.extract_files_from_response(response_message.content)
+            if result.content:
+                files_to_write = self.extract_files_from_response(result.content)
                 if files_to_write:
                     self.write_files(files_to_write)
+                    self.prune_image_descriptions()
                     print("Files updated successfully!")
                 else:
                     print("No file changes were found in the response.")
-                    
+            return usage
+
+        except KeyboardInterrupt:
+            # Ctrl-C abandons this modification only, not the whole session
+            print("\nModification cancelled.")
+            return usage
         except Exception as e:
             print(f"Error calling OpenAI API: {e}")
+            return usage
+
+    def record_usage(self, usage):
+        """Add a modification's token usage to the session total and report it."""
+        for key in self.session_usage:
+            self.session_usage[key] += usage.get(key, 0)
+        print(f"Session token usage: {self.session_usage}")
 
     def generate_image(self, filename: str, description: str):
         """Generate an image using DALL-E or another image generation service."""
@@ -300,21 +369,30 @@ Important notes:
         # prompt user to continue
         if not already_exists:
             print("Doing first iteration with requirements...")
-            self.modify_app(requirements)
+            self.record_usage(self.modify_app(requirements))
         
+        interrupted = False
         try:
             while True:
                 user_instruction = input("\nAdditional modification instructions: ").strip()
                 if user_instruction.lower() in ['exit', 'quit', 'q']:
                     break
                 reviewer_feedback = review_landing_page(self.app_name, requirements, user_instruction)
-                self.modify_app(reviewer_feedback)
+                self.record_usage(self.modify_app(reviewer_feedback))
         
         except KeyboardInterrupt:
             print("\nInterrupt received.")
+            interrupted = True
         finally:
             if self.dev_process is not None:
                 self.dev_process.terminate()
+            if interrupted:
+                cancel_upgrades()
+            else:
+                try:
+                    wait_for_upgrades()
+                except KeyboardInterrupt:
+                    cancel_upgrades()
 
 
 def main():
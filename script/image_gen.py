@@ -1,5 +1,8 @@
 import replicate
 import os
+import tempfile
+import threading
+from concurrent.futures import Future, wait
 
 # Add environment variable check at the start
 if 'REPLICATE_API_TOKEN' not in os.environ:
@@ -16,9 +19,18 @@ models = {
 #    print(f"https://replicate.com/{model}")
 
 
-# N.B. file extension is *implied* by the model. `filename` is a *base* name (without extension)
-def get_image(prompt: str, full_path: str, model=models['flux']):
-    # extension = 'svg' if 'svg' in model else 'png'
+# Background workers that upgrade draft images to the high-quality model
+# N.B. daemon threads so an interrupted session exits without waiting on in-flight renders
+_upgrade_slots = threading.Semaphore(2)
+# future -> full path of the image it upgrades
+_pending_upgrades = {}
+# Guards the check-then-swap of image files against concurrent writers
+_swap_lock = threading.Lock()
+# Set by cancel_upgrades() on interrupt
+_upgrades_cancelled = False
+
+
+def _render(prompt: str, model: str) -> bytes:
     output  = replicate.run(
         model,
         input={'prompt': prompt}
@@ -26,10 +38,134 @@ def get_image(prompt: str, full_path: str, model=models['flux']):
     # N.B. fix ambiguous model result (list[fo] vs fo)
     if isinstance(output, list):
         output = output[0]
+    return output.read()
+
+
+def _write_atomic(full_path: str, data: bytes):
+    """Write to a temp file next to `full_path`, then rename it into place."""
+    directory = os.path.dirname(full_path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, full_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def _file_signature(full_path: str):
+    try:
+        st = os.stat(full_path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+
+# N.B. file extension is *implied* by the model. `filename` is a *base* name (without extension)
+def get_image(prompt: str, full_path: str, model=models['flux']):
+    # extension = 'svg' if 'svg' in model else 'png'
+    data = _render(prompt, model)
     # Save the generated image
-    os.makedirs(os.path.dirname(full_path), exist_ok=True)
-    with open(full_path, 'wb') as f:
-        f.write(output.read())
+    with _swap_lock:
+        _write_atomic(full_path, data)
+
+
+def _stale_reason(full_path: str, draft_signature, is_current):
+    """Why an upgrade should be skipped, or None if it is still wanted."""
+    if _upgrades_cancelled:
+        return "upgrades were cancelled"
+    if _file_signature(full_path) != draft_signature:
+        return "image was replaced or removed"
+    if is_current is not None and not is_current():
+        return "image is no longer in use"
+    return None
+
+
+def _upgrade_image(prompt: str, full_path: str, model: str, draft_signature, is_current):
+    # Cheap check first, so a queued upgrade that went stale doesn't pay for a slow render
+    reason = _stale_reason(full_path, draft_signature, is_current)
+    if reason is None:
+        data = _render(prompt, model)
+        with _swap_lock:
+            # Re-check, the draft may have been replaced or dropped while rendering
+            reason = _stale_reason(full_path, draft_signature, is_current)
+            if reason is None:
+                _write_atomic(full_path, data)
+    if reason is not None:
+        print(f"Skipping upgrade of {full_path}: {reason}")
+        return
+    print(f"Upgraded {full_path} to {model}")
+
+
+def queue_upgrade(prompt: str, full_path: str, final_model=models['flux'], is_current=None):
+    """
+    Re-render the draft at `full_path` with `final_model` in the background and swap it in.
+
+    Args:
+        is_current: optional callable; the upgrade is dropped unless it returns True at swap time
+    """
+    with _swap_lock:
+        draft_signature = _file_signature(full_path)
+
+    future = Future()
+    _pending_upgrades[future] = full_path
+    future.add_done_callback(_on_upgrade_done)
+    args = (prompt, full_path, final_model, draft_signature, is_current)
+    threading.Thread(target=_run_upgrade, args=(future, args), name="image-upgrade", daemon=True).start()
+    return future
+
+
+def _run_upgrade(future: Future, args):
+    with _upgrade_slots:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(_upgrade_image(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+
+def _on_upgrade_done(future):
+    _pending_upgrades.pop(future, None)
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Error upgrading image: {future.exception()}")
+
+
+def pending_upgrade_paths():
+    """Paths of images that are still drafts awaiting their upgrade."""
+    return set(_pending_upgrades.values())
+
+
+def write_file(full_path: str, data: bytes):
+    """Atomically write a file that upgrade workers may read concurrently."""
+    with _swap_lock:
+        _write_atomic(full_path, data)
+
+
+def copy_image(src_path: str, dest_path: str):
+    """Atomically copy an existing image to `dest_path`."""
+    with _swap_lock:
+        with open(src_path, 'rb') as f:
+            data = f.read()
+        _write_atomic(dest_path, data)
+
+
+def wait_for_upgrades():
+    """Block until all background image upgrades have finished."""
+    if _pending_upgrades:
+        print(f"Waiting for {len(_pending_upgrades)} image upgrade(s) to finish...")
+        wait(list(_pending_upgrades))
+
+
+def cancel_upgrades():
+    """Drop queued upgrades; upgrades already rendering are not swapped in."""
+    global _upgrades_cancelled
+    _upgrades_cancelled = True
+    for future in list(_pending_upgrades):
+        future.cancel()
 
 
 if __name__ == "__main__":
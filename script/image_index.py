@@ -0,0 +1,127 @@
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Collection, Dict, List, Optional, Tuple
+
+STOP_WORDS = {
+    "a", "an", "and", "the", "of", "in", "on", "at", "for", "with", "to", "by",
+    "is", "are", "image", "picture", "photo", "showing", "featuring",
+}
+
+
+# Words a model adds when re-requesting an image that do not change what it shows
+FILLER_WORDS = {
+    "again", "same", "another", "version", "please", "redo", "regenerate",
+}
+
+
+def _stem(token: str) -> str:
+    # N.B. only folds simple plurals ("walkers" -> "walker")
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase a description and split it into content words."""
+    return [
+        _stem(t) for t in re.findall(r"[a-z0-9]+", text.lower())
+        if t not in STOP_WORDS and t not in FILLER_WORDS
+    ]
+
+
+class ImageIndex:
+    """TF-IDF index over image descriptions stored in projects' public/images.json."""
+
+    def __init__(self):
+        # full_path -> (description, term counts) per indexed image
+        self.entries: Dict[str, Tuple[str, Counter]] = {}
+        self.doc_freq: Counter = Counter()
+
+    def add(self, full_path: str, description: str):
+        """Add an image to the index, replacing any previous entry for the same file."""
+        full_path = os.path.abspath(full_path)
+        if full_path in self.entries:
+            _, old_terms = self.entries[full_path]
+            self.doc_freq.subtract(old_terms.keys())
+        terms = Counter(tokenize(description))
+        self.entries[full_path] = (description, terms)
+        self.doc_freq.update(terms.keys())
+
+    def description(self, full_path: str) -> Optional[str]:
+        """Return the indexed description of an image, if any."""
+        entry = self.entries.get(os.path.abspath(full_path))
+        return entry[0] if entry is not None else None
+
+    def add_project(self, app_dir: str):
+        """Index every described image in a project that still exists on disk."""
+        images_json_path = os.path.join(app_dir, 'public', 'images.json')
+        if not os.path.exists(images_json_path):
+            return
+        try:
+            with open(images_json_path, 'r') as f:
+                images = json.load(f)
+        except json.JSONDecodeError:
+            return
+        for filename, description in images.items():
+            full_path = os.path.join(app_dir, 'public', filename)
+            if os.path.exists(full_path):
+                self.add(full_path, description)
+
+    def _idf(self, term: str) -> float:
+        n = len(self.entries)
+        return math.log((1 + n) / (1 + self.doc_freq[term])) + 1
+
+    def _vector(self, terms: Counter) -> Dict[str, float]:
+        return {term: count * self._idf(term) for term, count in terms.items()}
+
+    def find_similar(self, description: str, threshold: float, exclude: Collection[str] = ()) -> Optional[Tuple[str, str, float]]:
+        """
+        Find the indexed image whose description best matches `description`.
+
+        Only images described with exactly the same content words are candidates:
+        a single differing word ("morning" vs "night") can change the image
+        entirely, yet barely moves the cosine score of a long description.
+
+        Args:
+            exclude: paths of images that must not be returned
+
+        Returns:
+            (full_path, description, score) of the best match at or above `threshold`, or None.
+        """
+        exclude = {os.path.abspath(path) for path in exclude}
+        query = self._vector(Counter(tokenize(description)))
+        query_norm = math.sqrt(sum(w * w for w in query.values()))
+        if query_norm == 0:
+            return None
+
+        query_terms = set(query)
+        best = None
+        for full_path, (existing_description, terms) in self.entries.items():
+            if full_path in exclude or set(terms) != query_terms:
+                continue
+            vector = self._vector(terms)
+            norm = math.sqrt(sum(w * w for w in vector.values()))
+            if norm == 0:
+                continue
+            dot = sum(w * vector.get(term, 0.0) for term, w in query.items())
+            score = dot / (query_norm * norm)
+            if score >= threshold and (best is None or score > best[2]):
+                best = (full_path, existing_description, score)
+        return best
+
+
+def build_index(app_dir: str, projects_dir: Optional[str] = None) -> ImageIndex:
+    """
+    Build an index for the current project, plus every project in `projects_dir` if given.
+    """
+    index = ImageIndex()
+    index.add_project(app_dir)
+    if projects_dir and os.path.isdir(projects_dir):
+        for name in sorted(os.listdir(projects_dir)):
+            other_dir = os.path.join(projects_dir, name)
+            if os.path.isdir(other_dir) and os.path.abspath(other_dir) != os.path.abspath(app_dir):
+                index.add_project(other_dir)
+    return index
@@ -0,0 +1,58 @@
+from image_index import ImageIndex, tokenize
+
+# Must match image_reuse_threshold in create_next_app.py
+THRESHOLD = 0.9
+
+HERO = "hero image of a dog walker at sunset"
+LONG = ("A wide hero banner of a friendly professional dog walker strolling with three "
+        "happy dogs through a leafy city park, warm cinematic lighting, shot in the")
+
+
+def make_index(*descriptions):
+    index = ImageIndex()
+    for i, description in enumerate(descriptions):
+        index.add(f"/app/public/{i}.png", description)
+    return index
+
+
+def test_tokenize_drops_stop_and_filler_words_and_folds_plurals():
+    assert tokenize("Hero image of a Dog-Walker, again!") == ["hero", "dog", "walker"]
+    assert tokenize("three dogs on grass") == ["three", "dog", "grass"]
+
+
+def test_rerequest_with_filler_words_is_reused():
+    index = make_index(HERO, "minimalist neon logo for Pawfect Walks")
+    match = index.find_similar("Hero image of a dog walker at sunset again", THRESHOLD)
+    assert match is not None
+    assert match[0] == "/app/public/0.png"
+    assert match[2] >= THRESHOLD
+
+
+def test_single_differing_word_is_not_reused():
+    for others in ([], ["minimalist neon logo", "cat in the rain", "city skyline at dusk"]):
+        index = make_index(LONG + " morning", *others)
+        assert index.find_similar(LONG + " night", THRESHOLD) is None
+        assert index.find_similar(LONG + " morning", THRESHOLD) is not None
+
+
+def test_unrelated_description_is_not_reused():
+    index = make_index(HERO)
+    assert index.find_similar("cat sleeping on a sofa", THRESHOLD) is None
+
+
+def test_exclude_skips_paths():
+    index = make_index(HERO)
+    assert index.find_similar(HERO, THRESHOLD, exclude={"/app/public/0.png"}) is None
+
+
+def test_add_replaces_previous_entry_for_same_path():
+    index = ImageIndex()
+    index.add("/app/public/hero.png", "dog at sunset")
+    index.add("/app/public/hero.png", "cat in rain")
+
+    assert len(index.entries) == 1
+    assert index.description("/app/public/hero.png") == "cat in rain"
+    assert index.doc_freq["dog"] == 0
+    assert index.doc_freq["cat"] == 1
+    assert index.find_similar("dog at sunset", THRESHOLD) is None
+    assert index.find_similar("cat in rain", THRESHOLD)[0] == "/app/public/hero.png"
@@ -0,0 +1,168 @@
+import json
+from typing import Callable, Dict, List, Optional
+
+# Tool results longer than this are truncated when earlier rounds are summarized
+SUMMARY_RESULT_CHARS = 200
+
+
+def empty_usage() -> Dict[str, int]:
+    return {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+
+
+class ToolLoopResult:
+    """Outcome of a tool loop: the final assistant content plus accounting."""
+
+    def __init__(self, content: Optional[str], rounds: int, usage: Dict[str, int], stop_reason: str):
+        self.content = content
+        self.rounds = rounds
+        self.usage = usage
+        # One of "done", "max_rounds", "token_budget"
+        self.stop_reason = stop_reason
+
+
+class ToolLoop:
+    """
+    Chat completion loop that executes tool calls until the model answers.
+
+    The loop is bounded: after `max_rounds` tool rounds, or once `max_total_tokens`
+    have been spent, the model is asked for its final answer with tools disabled.
+    Tool rounds older than the most recent `keep_recent_rounds` are compacted into
+    a short summary so the resent history stays small. Responses are streamed, so
+    a KeyboardInterrupt cancels the loop mid-response and closes the connection.
+    """
+
+    def __init__(self, client, model: str, tools: List[dict], handlers: Dict[str, Callable[[dict], str]],
+                 max_rounds: int = 8, max_total_tokens: int = 400_000, keep_recent_rounds: int = 1,
+                 reasoning_effort: Optional[str] = None):
+        self.client = client
+        self.model = model
+        self.tools = tools
+        self.handlers = handlers
+        self.max_rounds = max_rounds
+        self.max_total_tokens = max_total_tokens
+        self.keep_recent_rounds = keep_recent_rounds
+        self.reasoning_effort = reasoning_effort
+
+    def _stream_completion(self, messages: List[dict], allow_tools: bool, usage: Dict[str, int]):
+        """Stream one completion. Returns (content, tool_calls)."""
+        kwargs = {}
+        if self.reasoning_effort is not None:
+            kwargs["reasoning_effort"] = self.reasoning_effort
+        stream = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages,
+            tools=self.tools,
+            tool_choice="auto" if allow_tools else "none",
+            stream=True,
+            stream_options={"include_usage": True},
+            **kwargs,
+        )
+
+        content_parts = []
+        tool_calls = {}
+        try:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    for key in usage:
+                        usage[key] += getattr(chunk.usage, key, 0) or 0
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.content:
+                    content_parts.append(delta.content)
+                # N.B. tool calls arrive in fragments keyed by index
+                for tc in delta.tool_calls or []:
+                    call = tool_calls.setdefault(tc.index, {
+                        "id": None,
+                        "type": "function",
+                        "function": {"name": "", "arguments": ""},
+                    })
+                    if tc.id:
+                        call["id"] = tc.id
+                    if tc.function is not None:
+                        if tc.function.name:
+                            call["function"]["name"] += tc.function.name
+                        if tc.function.arguments:
+                            call["function"]["arguments"] += tc.function.arguments
+        finally:
+            stream.close()
+
+        content = "".join(content_parts) or None
+        return content, [tool_calls[i] for i in sorted(tool_calls)]
+
+    def _summarize_round(self, round_messages: List[dict]) -> List[str]:
+        """Describe a completed tool round in one line per tool call."""
+        results = {m["tool_call_id"]: m["content"] for m in round_messages if m["role"] == "tool"}
+        lines = []
+        for call in round_messages[0]["tool_calls"]:
+            result = results.get(call["id"], "")
+            if len(result) > SUMMARY_RESULT_CHARS:
+                result = result[:SUMMARY_RESULT_CHARS] + "..."
+            lines.append(f"- {call['function']['name']}({call['function']['arguments']}): {result}")
+        return lines
+
+    def _build_messages(self, base: List[dict], summary: List[str], recent_rounds: List[List[dict]]) -> List[dict]:
+        messages = list(base)
+        if summary:
+            messages.append({
+                "role": "assistant",
+                "content": "Summary of my earlier tool calls:\n" + "\n".join(summary),
+            })
+        for round_messages in recent_rounds:
+            messages.extend(round_messages)
+        return messages
+
+    def run(self, messages: List[dict], usage: Optional[Dict[str, int]] = None) -> ToolLoopResult:
+        """
+        Run the loop starting from `messages` (typically system + user prompt).
+
+        Token usage is accumulated into `usage` as it arrives, so it stays
+        accurate even if the loop raises.
+        """
+        if usage is None:
+            usage = empty_usage()
+        summary = []
+        recent_rounds = []
+        rounds = 0
+        stop_reason = "done"
+
+        while True:
+            if rounds >= self.max_rounds:
+                stop_reason = "max_rounds"
+            elif usage["total_tokens"] >= self.max_total_tokens:
+                stop_reason = "token_budget"
+            allow_tools = stop_reason == "done"
+            if not allow_tools:
+                print(f"Tool loop limit reached ({stop_reason}), requesting final answer...")
+
+            content, tool_calls = self._stream_completion(self._build_messages(messages, summary, recent_rounds), allow_tools, usage)
+
+            # If there are no tool calls (or tools are disabled), we're done
+            if not tool_calls or not allow_tools:
+                return ToolLoopResult(content, rounds, usage, stop_reason)
+
+            rounds += 1
+            round_messages = [{"role": "assistant", "content": content, "tool_calls": tool_calls}]
+            for call in tool_calls:
+                name = call["function"]["name"]
+                handler = self.handlers.get(name)
+                if handler is None:
+                    output = f"Unknown tool: {name}"
+                else:
+                    # A failed call is reported back to the model instead of ending the loop
+                    try:
+                        output = handler(json.loads(call["function"]["arguments"]))
+                    except Exception as e:
+                        print(f"Tool call {name} failed: {e!r}")
+                        output = f"Error: {e!r}"
+                round_messages.append({
+                    "tool_call_id": call["id"],
+                    "role": "tool",
+                    "name": name,
+                    "content": output,
+                })
+
+            recent_rounds.append(round_messages)
+            # Compact rounds that have fallen out of the recent window
+            while len(recent_rounds) > self.keep_recent_rounds:
+                summary.extend(self._summarize_round(recent_rounds.pop(0)))